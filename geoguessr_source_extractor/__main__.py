@@ -23,8 +23,8 @@ def main() -> None:
 	argparser.add_argument(
 		'--max_connections',
 		type=int,
-		help='Max connections to use when downloading, defaults to 1',
-		default=1,
+		help='Max connections to use when downloading, defaults to 16',
+		default=16,
 	)
 	argparser.add_argument(
 		'--force-redownload',
@@ -43,6 +43,12 @@ def main() -> None:
 		help='By default (--no-force-redownload-static-files), static files will not be redownloaded if they are already there, use this to make it redownload it anyway',
 		default=False,
 	)
+	argparser.add_argument(
+		'--beautify',
+		action=BooleanOptionalAction,
+		help='Beautify the more interesting JavaScript files when downloading them so they are nicer to read, defaults to true, --no-beautify makes downloading faster and extracting slightly faster',
+		default=True,
+	)
 	levels = logging.getLevelNamesMapping()
 	argparser.add_argument(
 		'--log-level',
@@ -64,6 +70,7 @@ def main() -> None:
 				force_redownload=args.force_redownload,
 				download_static_files=args.download_static_files,
 				force_redownload_static_files=args.force_redownload_static_files,
+				beautify=args.beautify,
 			)
 		)
 
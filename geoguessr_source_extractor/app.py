@@ -24,35 +24,32 @@ def parse_localizations_from_app(
 	tokens = tokenize_js(app)
 	# We gotta find function 15288, which has a big ass dict in it
 	# Yeah I know this is getting VERY specific, not to mention very fragile
+	# "15288: function(e, t, n)"
+	# (Checking the text of each token first, since that's rarely going to match, is quicker than going back through .previous.previous for every single token)
 	function_15288 = next(
-		t
+		t.next.next
 		for t in tokens
-		if t.previous
-		and t.previous.type == 'TK_OPERATOR'
-		and t.previous.text == ':'
-		and t.previous.previous.text == '15288'
+		if t.text == '15288' and t.next.type == 'TK_OPERATOR' and t.next.text == ':'
 	)
-	# "15288: function(e, t, n)"
 	function_args_start: Token | None = function_15288.next
 	assert function_args_start
 	function_args_end: Token | None = function_args_start.closed
 	assert function_args_end
 	function_body_start: Token = function_args_end.next
-	function_body = [t for t in tokens if t.parent == function_body_start]
+	function_body = [t for t in tokens if t.parent is function_body_start]
 
 	r_start = next(
-		t
+		t.next.next.next
 		for t in function_body
-		if t.previous.type == 'TK_EQUALS'
-		and t.previous.previous.text == 'r'
-		and t.previous.previous.previous.text == 'var'
+		if t.text == 'var' and t.next.text == 'r' and t.next.next.type == 'TK_EQUALS'
 	)
-	dict_source = ''
+	dict_parts = []
 	token = r_start
-	while token != r_start.closed:
-		dict_source += token.text
+	while token is not r_start.closed:
+		dict_parts.append(token.text)
 		token = token.next
-	dict_source += token.text
+	dict_parts.append(token.text)
+	dict_source = ''.join(dict_parts)
 
 	r = _dict_list_adapter.validate_json(dict_source)
 	# key: Relative URL fragment, something like ./en-US/country.json for example
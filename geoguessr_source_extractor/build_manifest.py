@@ -1,7 +1,7 @@
 from collections.abc import Mapping
 from typing import TYPE_CHECKING
 
-from .tokenize import tokenize_js
+from .tokenize import group_by_parent, tokenize_js
 from .typedefs import URLPath
 
 if TYPE_CHECKING:
@@ -19,6 +19,7 @@ def parse_build_manifest(build_manifest: 'JSSource') -> Mapping[URLPath, list[UR
 	Returns:
 		{/page route}: [list of .js/.css files used by that page]"""
 	tokens = tokenize_js(build_manifest, {'unescape_strings': True})
+	children_of = group_by_parent(tokens)
 	build_manifest_token = next(
 		t for t in tokens if t.type == 'TK_WORD' and t.text == '__BUILD_MANIFEST'
 	)
@@ -27,38 +28,31 @@ def parse_build_manifest(build_manifest: 'JSSource') -> Mapping[URLPath, list[UR
 	function_args_list_start = (
 		build_manifest_token.next.next.next
 	)  # next = TK_OPERATOR =, next.next = TK_RESERVED function
-	variables = [
-		t.text for t in tokens if t.parent == function_args_list_start and t.type == 'TK_WORD'
-	]
+	variables = [t.text for t in children_of[function_args_list_start] if t.type == 'TK_WORD']
 
 	function_body_start = function_args_list_start.closed.next
 	function_args_start = function_body_start.closed.next
-	args = [
-		t.text.strip('"')
-		for t in tokens
-		if t.parent == function_args_start and t.type == 'TK_STRING'
-	]
+	args = [t.text.strip('"') for t in children_of[function_args_start] if t.type == 'TK_STRING']
+	arg_values = dict(zip(variables, args))
 
 	return_token = next(
 		t
-		for t in tokens
-		if t.parent == function_body_start and t.type == 'TK_RESERVED' and t.text == 'return'
+		for t in children_of[function_body_start]
+		if t.type == 'TK_RESERVED' and t.text == 'return'
 	)
 	return_dict_start = return_token.next
 
 	d: dict[URLPath, list[URLPath]] = {}
 	# print([token.text for token in tokens if token.parent == return_dict_start and token.type == 'TK_WORD'])
 	# There are also some TK_WORD tokens in this dict: __rewrites, sortedPages
-	return_tokens = [
-		token for token in tokens if token.parent == return_dict_start and token.type == 'TK_STRING'
-	]
+	return_tokens = [token for token in children_of[return_dict_start] if token.type == 'TK_STRING']
 	for token in return_tokens:
 		key: str = token.text.strip('"')
 		assert token.next, 'token.next should be TK_OPERATOR : but it was None'
 		start = token.next.next
-		children = [t for t in tokens if t.parent == start and t.type != 'TK_COMMA']
+		children = [t for t in children_of[start] if t.type != 'TK_COMMA']
 		d[URLPath(key)] = [
-			_convert_path(c.text.strip('"') if c.type == 'TK_STRING' else args[variables.index(c.text)])
+			_convert_path(c.text.strip('"') if c.type == 'TK_STRING' else arg_values[c.text])
 			for c in children
 		]
 	return d
@@ -1,20 +1,20 @@
 """Converts extracted JSON data to more useful formats"""
 
 import asyncio
+import contextlib
 import logging
-import re
 from collections.abc import Iterable, Mapping, Sequence
+from concurrent.futures import Executor
 from pathlib import Path
 from typing import TYPE_CHECKING, Annotated, Any
 
-import aiofiles
-import aiofiles.os
+import numpy as np
 import pydantic
 import pydantic_core
 import shapely
 from tqdm.auto import tqdm
 
-from .utils import read_text, write_json, write_text
+from .utils import format_json
 
 if TYPE_CHECKING:
 	from shapely.geometry.base import BaseGeometry
@@ -45,10 +45,15 @@ class BoundingBox(pydantic.BaseModel, extra='forbid'):
 class BoundingBoxDict(pydantic.RootModel):
 	root: dict[str, BoundingBox]
 
-#hmm, more specifically it is _usually_ just an <svg> element by itself, but can include an XML declaration/comments/other things that thou shalt not parse via regex
-SVGStr = Annotated[
-	str, pydantic.StringConstraints(pattern=re.compile(r'<svg.+</svg>\s*$', re.DOTALL))
-]
+def _validate_svg(s: str) -> str:
+	#hmm, more specifically it is _usually_ just an <svg> element by itself, but can include an XML declaration/comments/other things that thou shalt not parse via regex
+	# Also no need for regex just to check what it starts and ends with, which is all we were doing
+	if '<svg' not in s or not s.rstrip().endswith('</svg>'):
+		raise ValueError('Does not look like an SVG')
+	return s
+
+
+SVGStr = Annotated[str, pydantic.AfterValidator(_validate_svg)]
 
 
 class SVGDict(pydantic.RootModel):
@@ -62,27 +67,53 @@ class RawSVGDict(pydantic.RootModel):
 	root: dict[str, RawSVGPath]
 
 
-ConvertableDictAdapter: pydantic.TypeAdapter[
-	PolygonCoordinatesDict | BoundingBoxDict | SVGDict | RawSVGDict
-] = pydantic.TypeAdapter(PolygonCoordinatesDict | BoundingBoxDict | SVGDict | RawSVGDict)
+ConvertableDict = PolygonCoordinatesDict | BoundingBoxDict | SVGDict | RawSVGDict
+ConvertableDictAdapter: pydantic.TypeAdapter[ConvertableDict] = pydantic.TypeAdapter(
+	ConvertableDict
+)
+
+
+def guess_convertable_type(raw: Any) -> type[ConvertableDict] | None:
+	"""Looks at the first value of some parsed JSON to guess which type it might be, so we only have to try validating it as that type and not all of them
+
+	This only looks at the first value, so it's a weaker check than validating against all of ConvertableDict, and the guess can still fail validation (or be None when something else would have worked, like an empty dict), in which case use ConvertableDictAdapter"""
+	if not isinstance(raw, dict) or not raw:
+		return None
+	first = next(iter(raw.values()))
+	if isinstance(first, list):
+		return PolygonCoordinatesDict
+	if isinstance(first, dict):
+		return BoundingBoxDict if 'NW' in first else None
+	if isinstance(first, str):
+		if '<svg' in first:
+			return SVGDict
+		if first.startswith('M'):
+			return RawSVGDict
+	return None
 
 
 def polygons_to_actual_polygon(coords: PolygonCoordinates) -> shapely.MultiPolygon:
 	# Okay so bad news: We can't really tell the difference between an exterior and interior here, and the code is too obfuscated to see what it's doing with that data
 	# Okay maybe… this
-	rings = [shapely.LinearRing(points) for points in coords]
+	if not coords:
+		return shapely.MultiPolygon()
+	# Make all the rings (and check all the pairs of them) in one go with shapely's vectorized functions, instead of one at a time
+	rings = shapely.linearrings(
+		np.concatenate(coords), indices=np.repeat(np.arange(len(coords)), [len(points) for points in coords])
+	)
+	outer_rings = rings[::2]
+	next_rings = rings[1::2]
+	outer_polys = shapely.polygons(outer_rings)
+	contains = shapely.contains(outer_polys[: len(next_rings)], next_rings)
+
 	polys = []
-	for i in range(0, len(rings), 2):
-		ring = rings[i]
-		poly = shapely.Polygon(ring)
-		if i + 1 == len(rings):
+	for i, poly in enumerate(outer_polys):
+		if i == len(next_rings):
 			polys.append(poly)
+		elif contains[i]:
+			polys.append(shapely.Polygon(outer_rings[i], [next_rings[i]]))
 		else:
-			next_ring = rings[i + 1]
-			if poly.contains(next_ring):
-				polys.append(shapely.Polygon(ring, [next_ring]))
-			else:
-				polys.extend((poly, shapely.Polygon(next_ring)))
+			polys.extend((poly, shapely.Polygon(next_rings[i])))
 
 	return shapely.MultiPolygon(polys)
 
@@ -99,7 +130,18 @@ def to_geojson(name: str, features: Sequence[tuple['BaseGeometry', Mapping[str,
 	}
 
 
-async def convert_polygon(data: PolygonCoordinatesDict, path: Path, out_dir: Path):
+def _write_text(path: Path, s: str):
+	# This all runs in a worker process, so just do plain old blocking I/O
+	path.parent.mkdir(parents=True, exist_ok=True)
+	path.write_text(s, 'utf-8')
+
+
+def _write_json(path: Path, data: Any):
+	path.parent.mkdir(parents=True, exist_ok=True)
+	path.write_bytes(format_json(data))
+
+
+def convert_polygon(data: PolygonCoordinatesDict, path: Path, out_dir: Path):
 	# index is usually a lowercase alpha-2 country code, but might not be
 	features = [
 		(polygons_to_actual_polygon(coords), {'index': index})
@@ -107,28 +149,27 @@ async def convert_polygon(data: PolygonCoordinatesDict, path: Path, out_dir: Pat
 	]
 	geojson = to_geojson(path.name, features)
 	out_path = out_dir / path.with_suffix('.geojson').name
-	await write_json(out_path, geojson)
+	_write_json(out_path, geojson)
 
 
-async def convert_box(data: BoundingBoxDict, path: Path, out_dir: Path):
+def convert_box(data: BoundingBoxDict, path: Path, out_dir: Path):
 	features = [
 		(shapely.Polygon([[corner.lng, corner.lat] for _, corner in box]), {'index': index})
 		for index, box in data.root.items()
 	]
 	geojson = to_geojson(path.name, features)
 	out_path = out_dir / path.with_suffix('.geojson').name
-	await write_json(out_path, geojson)
+	_write_json(out_path, geojson)
 
 
-async def convert_multiple_svg(data: SVGDict, path: Path, out_dir: Path):
+def convert_multiple_svg(data: SVGDict, path: Path, out_dir: Path):
 	out_dir /= path.stem
-	await aiofiles.os.makedirs(out_dir, exist_ok=True)
 	for index, svg in data.root.items():
 		svg_path = out_dir / f'{index}.svg'
-		await write_text(svg_path, svg)
+		_write_text(svg_path, svg)
 
 
-async def convert_raw_svg(data: RawSVGDict, path: Path, out_dir: Path):
+def convert_raw_svg(data: RawSVGDict, path: Path, out_dir: Path):
 	d = {}
 	# This is just what the explorer map uses
 	svg_start = '<svg width="820" height="520" viewBox="30 40 800 480">\n'
@@ -137,41 +178,58 @@ async def convert_raw_svg(data: RawSVGDict, path: Path, out_dir: Path):
 
 	svg_content = svg_start + '\n\t'.join(d.values()) + '\n</svg>'
 	out_path = out_dir / f'{path.stem}.svg'
-	await write_text(out_path, svg_content)
+	_write_text(out_path, svg_content)
 
 
-async def convert_file(path: Path, out_dir: Path):
-	content = await read_text(path)
+def convert_file(path: Path, out_dir: Path):
+	"""Converts one file, if it is something we know how to convert. This is blocking and CPU heavy (for polygons especially), so it's meant to be run in an executor."""
+	# pydantic_core can take the bytes as they are, so don't bother decoding them ourselves
+	content = path.read_bytes()
 
 	try:
-		data = ConvertableDictAdapter.validate_json(content)
-	except pydantic.ValidationError:
+		raw = pydantic_core.from_json(content)
+	except ValueError:
+		logger.info(
+			'Could not convert %s, not even JSON: %s', path, content.decode('utf-8', 'replace')
+		)
+		return
+
+	data = None
+	data_type = guess_convertable_type(raw)
+	if data_type:
+		with contextlib.suppress(pydantic.ValidationError):
+			data = data_type.model_validate(raw)
+	if data is None:
+		# Guessing didn't work, so see if it's anything at all (an empty dict is a PolygonCoordinatesDict, for example)
+		with contextlib.suppress(pydantic.ValidationError):
+			data = ConvertableDictAdapter.validate_python(raw)
+	if data is None:
 		# Just want to see what it looks like, not necessarily the whole thing
-		try:
-			raw = pydantic_core.from_json(content)
-			if isinstance(raw, dict):
-				raw = raw.popitem()
-				if isinstance(raw[0], str) and isinstance(raw[1], str):
-					#not really anything special/interesting
-					return
-			logger.info('Could not convert %s, unknown type: %s', path, raw)
-		except ValueError:
-			logger.info('Could not convert %s, not even JSON: %s', path, content)
+		if isinstance(raw, dict) and raw:
+			raw = raw.popitem()
+			if isinstance(raw[0], str) and isinstance(raw[1], str):
+				#not really anything special/interesting
+				return
+		logger.info('Could not convert %s, unknown type: %s', path, raw)
 		return
 
 	if isinstance(data, PolygonCoordinatesDict):
-		await convert_polygon(data, path, out_dir / 'Polygons')
+		convert_polygon(data, path, out_dir / 'Polygons')
 	elif isinstance(data, BoundingBoxDict):
-		await convert_box(data, path, out_dir / 'Bounding boxes')
+		convert_box(data, path, out_dir / 'Bounding boxes')
 	elif isinstance(data, SVGDict):
 		# probably flags of some kind
-		await convert_multiple_svg(data, path, out_dir / 'SVGs')
+		convert_multiple_svg(data, path, out_dir / 'SVGs')
 	elif isinstance(data, RawSVGDict):
-		await convert_raw_svg(data, path, out_dir / 'SVGs')
+		convert_raw_svg(data, path, out_dir / 'SVGs')
 
 
-async def convert_all_files(paths: Iterable[Path], out_dir: Path):
-	fs = [convert_file(path, out_dir) for path in paths]
-	with tqdm(asyncio.as_completed(fs), total=len(fs), desc='Converting', unit='file') as t:
+async def convert_all_files(paths: Iterable[Path], out_dir: Path, executor: Executor | None = None):
+	"""executor: Ideally a ProcessPoolExecutor so files can be converted in parallel, or None to use the event loop's default executor"""
+	loop = asyncio.get_running_loop()
+	fs = [loop.run_in_executor(executor, convert_file, path, out_dir) for path in paths]
+	with tqdm(
+		asyncio.as_completed(fs), total=len(fs), desc='Converting', unit='file', mininterval=0.5
+	) as t:
 		for result in t:
 			await result
@@ -3,34 +3,48 @@ import contextlib
 import itertools
 import logging
 from collections.abc import Collection, Mapping
+from concurrent.futures import Executor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-import aiofiles
-import aiofiles.os
 import jsbeautifier
 from aiohttp import ClientResponseError
 from tqdm.auto import tqdm
 
 from .build_manifest import parse_build_manifest
 from .find_urls import FoundURLs, find_urls_from_home_page
-from .utils import get_text
+from .utils import ensure_dir, get_text, write_text
 from .webpack import parse_webpack
 
 if TYPE_CHECKING:
 	import aiohttp
 
-	from .typedefs import URLPath
+	from .typedefs import JSSource, URLPath
 
 logger = logging.getLogger(__name__)
 
 
+def _beautify(js: 'JSSource') -> 'JSSource':
+	# We are using jsbeautifier to parse JavaScript anyway, so why not use it for its actual intended purpose too?
+	# (Well also given the whole point is to poke around in GeoGuessr to see what it does, we really should)
+	return jsbeautifier.beautify(js, {'indent_with_tabs': True})  # type: ignore[argument]
+
+
 async def _download_with_url(
-	session: 'aiohttp.ClientSession', url: 'URLPath', semaphore: asyncio.Semaphore | None = None
+	session: 'aiohttp.ClientSession',
+	url: 'URLPath',
+	semaphore: asyncio.Semaphore | None = None,
+	executor: Executor | None = None,
+	*,
+	beautify: bool = True,
 ) -> tuple['URLPath', str]:
 	async with contextlib.nullcontext() if semaphore is None else semaphore:
-		return url, await get_text(session, url)
+		text = await get_text(session, url)
+	if beautify and url.suffix == '.js':
+		# Beautifying is slow and CPU bound, so don't hold up everything else while it happens
+		text = await asyncio.get_running_loop().run_in_executor(executor, _beautify, text)
+	return url, text
 
 
 @dataclass
@@ -69,10 +83,19 @@ async def discover_files(session: 'aiohttp.ClientSession') -> DiscoveredFiles:
 
 
 async def download_source(
-	session: 'aiohttp.ClientSession', website_source_dir: Path, max_connections: int = 1
+	session: 'aiohttp.ClientSession',
+	website_source_dir: Path,
+	max_connections: int = 16,
+	executor: Executor | None = None,
+	*,
+	beautify: bool = True,
 ):
 	"""Discovers GeoGuessr source and downloads to a directory.
 
+	Arguments:
+		executor: Used to beautify JavaScript, ideally a ProcessPoolExecutor, or None to use the event loop's default executor
+		beautify: Whether to beautify the more interesting JavaScript files, which is only for the benefit of humans reading it, the extraction stuff copes fine with minified source (and is faster on it as there are fewer tokens)
+
 	Returns:
 		(DiscoveredFiles, set of all local paths that we downloaded)"""
 	# getPageList() {
@@ -81,14 +104,26 @@ async def download_source(
 	#
 	files = await discover_files(session)
 
+	# Chunks that only webpack knows about get loaded lazily, and tend to be big third party libraries that aren't very interesting to read, so they aren't worth the time it takes to beautify them
+	to_beautify: set['URLPath'] = set()
+	if beautify:
+		to_beautify.update(itertools.chain.from_iterable(files.build_manifest.values()))
+		to_beautify.update((files.urls.build_manifest, files.urls.webpack, files.urls.app))
+
 	semaphore = asyncio.Semaphore(max_connections)
-	futures = [_download_with_url(session, chunk_url, semaphore) for chunk_url in files.files]
+	futures = [
+		_download_with_url(
+			session, chunk_url, semaphore, executor, beautify=chunk_url in to_beautify
+		)
+		for chunk_url in files.files
+	]
 	out_paths: set[Path] = set()
 	with tqdm(
 		asyncio.as_completed(futures),
 		desc='Downloading source files',
 		unit='file',
 		total=len(futures),
+		mininterval=0.5,
 	) as t:
 		for result in t:
 			try:
@@ -97,19 +132,13 @@ async def download_source(
 				# This can happen for some files, don't panic
 				logger.error('Error: %s', e)
 				continue
-			t.set_postfix(url=chunk_url)
+			# Don't redraw the bar every single time, let mininterval decide when
+			t.set_postfix(url=chunk_url, refresh=False)
 
 			out_path = website_source_dir / chunk_url
-			chunk_dir = out_path.parent
-			await aiofiles.os.makedirs(chunk_dir, exist_ok=True)
-
-			if out_path.suffix == '.js':
-				# We are using jsbeautifier to parse JavaScript anyway, so why not use it for its actual intended purpose too?
-				# (Well also given the whole point is to poke around in GeoGuessr to see what it does, we really should)
-				chunk = jsbeautifier.beautify(chunk, {'indent_with_tabs': True})  # type: ignore[argument]
+			await ensure_dir(out_path.parent)
 
-			async with aiofiles.open(out_path, 'w', encoding='utf8') as f:
-				await f.write(chunk)
+			await write_text(out_path, chunk)
 			out_paths.add(out_path)
 
 	return files, out_paths
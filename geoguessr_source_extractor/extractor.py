@@ -2,13 +2,14 @@ import asyncio
 import contextlib
 import itertools
 import logging
-from collections.abc import Collection, Iterable, Mapping
+import os
+from collections.abc import Collection, Iterable, Iterator, Mapping
+from concurrent.futures import Executor, ProcessPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path, PurePath, PurePosixPath
 from typing import TYPE_CHECKING, Any
 
 import aiofiles
-import aiofiles.os
 import aiofiles.ospath
 import aiohttp
 from tqdm.auto import tqdm
@@ -27,8 +28,10 @@ from .utils import (
 	abbrev_path,
 	deltree_if_exists,
 	download_binary_file,
+	ensure_dir,
 	read_text,
 	reverse_dict_of_lists,
+	reverse_dict_of_path_lists,
 	write_json,
 )
 
@@ -67,36 +70,67 @@ class InterestingThingsInAllFiles:
 			self.objects[path] = things.objects
 
 
-async def _find_interesting_things_in_file(file: Path, root_dir: Path):
+async def _find_interesting_things_in_file(
+	file: Path, root_dir: Path, executor: Executor | None = None
+):
 	relative_path = abbrev_path(file, root_dir)
-	return file, await find_interesting_things(file, relative_path)
+	return file, await find_interesting_things(file, relative_path, executor)
 
 
 async def find_interesting_things_in_all_files(
-	website_source_dir: Path, source_files: Iterable[Path]
+	website_source_dir: Path, source_files: Iterable[Path], executor: Executor | None = None
 ):
-	futures = [
-		_find_interesting_things_in_file(file, website_source_dir)
-		for file in source_files
-		if file.suffix == '.js'
-	]
+	"""Has a few workers take files off a queue and put what they found onto another queue, instead of making a task for every single file all at once, which gets a bit much when there are thousands of them"""
+	todo: asyncio.Queue[Path] = asyncio.Queue()
+	for file in source_files:
+		if file.suffix == '.js':
+			todo.put_nowait(file)
+	total = todo.qsize()
+	done: asyncio.Queue[tuple[Path, InterestingThings]] = asyncio.Queue()
+
+	async def worker():
+		while True:
+			try:
+				file = todo.get_nowait()
+			except asyncio.QueueEmpty:
+				return
+			result = await _find_interesting_things_in_file(file, website_source_dir, executor)
+			await done.put(result)
 
 	results = InterestingThingsInAllFiles()
 
-	with tqdm(
-		asyncio.as_completed(futures),
-		desc='Looking for interesting things',
-		unit='file',
-		total=len(futures),
-	) as t:
-		for result in t:
-			file, things = await result
-			t.set_postfix(file=file)
-			results.combine(file, things)
+	# The work itself happens in the executor, so there's no point having more workers than it has processes
+	num_workers = min(os.cpu_count() or 1, total)
+	async with asyncio.TaskGroup() as task_group:
+		for _ in range(num_workers):
+			task_group.create_task(worker())
+
+		with tqdm(
+			desc='Looking for interesting things', unit='file', total=total, mininterval=0.5
+		) as t:
+			for _ in range(total):
+				file, things = await done.get()
+				t.set_postfix(file=file, refresh=False)
+				t.update()
+				results.combine(file, things)
 
 	return results
 
 
+def _iter_js_files(directory: Path) -> Iterator[Path]:
+	"""Finds .js files in directory and all its subdirectories, which is all we look at out of what has been downloaded.
+
+	os.scandir already knows which entries are directories without having to stat them again, so this is quicker than rglob when there are lots of static files in there."""
+	dirs = [directory]
+	while dirs:
+		with os.scandir(dirs.pop()) as entries:
+			for entry in entries:
+				if entry.is_dir(follow_symlinks=False):
+					dirs.append(Path(entry.path))
+				elif entry.name.endswith('.js'):
+					yield Path(entry.path)
+
+
 def _is_downloaded_file(path: Path, name_pattern: str, website_source_dir: Path):
 	if not path.is_relative_to(website_source_dir):
 		return False
@@ -250,16 +284,18 @@ async def extract_things_from_source(
 	*,
 	download_static_files: bool = False,
 	force_redownload_static_files: bool = False,
+	max_connections: int = 16,
+	executor: Executor | None = None,
 ):
 	# There is just js and css in there
-	await aiofiles.os.makedirs(extracted_data_dir, exist_ok=True)
+	await ensure_dir(extracted_data_dir)
 
 	localized_data = await _extract_app(
 		extracted_data_dir, downloaded_paths, website_source_dir, app_url_path
 	)
 
 	interesting_things = await find_interesting_things_in_all_files(
-		website_source_dir, downloaded_paths
+		website_source_dir, downloaded_paths, executor
 	)
 
 	# Getting real sick of this "keys can only be str/bool/int/blah" nonsense
@@ -275,23 +311,13 @@ async def extract_things_from_source(
 			_dump_static_urls(static_urls, extracted_data_dir),
 			write_json(
 				extracted_data_dir / 'API URLs.json',
-				reverse_dict_of_lists(
-					{
-						abbrev_path(k, website_source_dir): v
-						for k, v in interesting_things.other_api_urls.items()
-					}
-				),
+				reverse_dict_of_path_lists(interesting_things.other_api_urls, website_source_dir),
 				sort_keys=True,
 			),
 			_dump_json_data(interesting_things.jsons, localized_data, extracted_data_dir),
 			write_json(
 				extracted_data_dir / 'Other URLs.json',
-				reverse_dict_of_lists(
-					{
-						abbrev_path(k, website_source_dir): v
-						for k, v in interesting_things.other_urls.items()
-					}
-				),
+				reverse_dict_of_path_lists(interesting_things.other_urls, website_source_dir),
 				sort_keys=True,
 			),
 			_dump_arrays_objects(
@@ -315,7 +341,7 @@ async def extract_things_from_source(
 			paths_to_download[f'http://www.geoguessr.com/{static_url}'] = out_path
 
 	if paths_to_download:
-		semaphore = asyncio.Semaphore(1)
+		semaphore = asyncio.Semaphore(max_connections)
 		futures = [
 			download_binary_file(static_url, out_path, session, semaphore)
 			for static_url, out_path in paths_to_download.items()
@@ -339,42 +365,55 @@ async def dump_build_manifest(files: DiscoveredFiles, extracted_data_dir: Path):
 async def download_and_extract(
 	website_source_dir: Path,
 	extracted_data_dir: Path,
-	max_connections: int = 1,
+	max_connections: int = 16,
 	*,
 	force_redownload: bool = False,
 	download_static_files: bool = True,
 	force_redownload_static_files: bool = False,
+	beautify: bool = True,
 ):
 	"""The main entry point of sorts."""
-	session = aiohttp.ClientSession()
+	# Pretty much everything we download is from www.geoguessr.com, so let it have all the connections, and keep them around to reuse them
+	connector = aiohttp.TCPConnector(
+		limit=max_connections,
+		limit_per_host=max_connections,
+		ttl_dns_cache=300,
+		keepalive_timeout=30,
+	)
+	session = aiohttp.ClientSession(connector=connector)
 	# Probably a good idea?
 	session.headers['User-Agent'] = (
 		'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36'
 	)
 
-	async with session:
-		if force_redownload or not await aiofiles.ospath.isdir(website_source_dir):
-			await deltree_if_exists(website_source_dir)
-			files, downloaded_paths = await download_source(
-				session, website_source_dir, max_connections
+	# Beautifying and tokenizing JavaScript (and converting polygons) is the slow part, and CPU bound, so spread it out across processes
+	with ProcessPoolExecutor() as executor:
+		async with session:
+			if force_redownload or not await aiofiles.ospath.isdir(website_source_dir):
+				await deltree_if_exists(website_source_dir)
+				files, downloaded_paths = await download_source(
+					session, website_source_dir, max_connections, executor, beautify=beautify
+				)
+				await dump_build_manifest(files, extracted_data_dir)
+				app_path = files.urls.app
+			else:
+				downloaded_paths = frozenset(_iter_js_files(website_source_dir))
+				app_path = None
+
+			await extract_things_from_source(
+				extracted_data_dir,
+				website_source_dir,
+				downloaded_paths,
+				app_path,
+				session,
+				download_static_files=download_static_files,
+				force_redownload_static_files=force_redownload_static_files,
+				max_connections=max_connections,
+				executor=executor,
 			)
-			await dump_build_manifest(files, extracted_data_dir)
-			app_path = files.urls.app
-		else:
-			downloaded_paths = frozenset(website_source_dir.rglob('*'))
-			app_path = None
 
-		await extract_things_from_source(
+		await convert_all_files(
+			(*extracted_data_dir.glob('JSONs/*.json'), *extracted_data_dir.glob('Objects/*.json')),
 			extracted_data_dir,
-			website_source_dir,
-			downloaded_paths,
-			app_path,
-			session,
-			download_static_files=download_static_files,
-			force_redownload_static_files=force_redownload_static_files,
+			executor,
 		)
-
-	await convert_all_files(
-		(*extracted_data_dir.glob('JSONs/*.json'), *extracted_data_dir.glob('Objects/*.json')),
-		extracted_data_dir,
-	)
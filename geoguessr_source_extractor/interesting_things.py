@@ -1,15 +1,19 @@
+import asyncio
 import contextlib
-import json
+import hashlib
 import logging
+import operator
 import re
-from collections.abc import Collection, Iterable, Mapping
+from collections import OrderedDict
+from collections.abc import Collection, Mapping, Sequence
+from concurrent.futures import Executor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import TYPE_CHECKING, Any
 
 import pydantic_core
 
-from .tokenize import describe_token, tokenize_js
+from .tokenize import describe_token, group_by_parent, tokenize_js
 from .typedefs import URLPath
 from .utils import read_text
 
@@ -29,24 +33,51 @@ class UnexpectedParseError(NotParseableError):
 	"""Something happened in parsing which we didn't expect, which means we can't parse it, but it might be worth warning about"""
 
 
-def _convert_hex_escape(match: re.Match[str]):
+# \x and \u escapes, or a backslash followed by anything else, so everything gets unescaped in one go
+# This all works on the UTF-8 encoded bytes, because pydantic_core would only be encoding it to that anyway
+_unescape_regex = re.compile(rb'\\(?:x([\dA-Fa-f]{2})|u([\dA-Fa-f]{4})|(.))')
+# For when there are no \x or \u escapes, which is most of the time, so every match just becomes the character after the backslash
+_simple_unescape_regex = re.compile(rb'\\(.)')
+# Match.__getitem__ is implemented in C, so unlike a lambda or a replacement template (which on older Pythons ends up calling back into Python code anyway) this doesn't run any Python code per match
+_escaped_char = operator.itemgetter(1)
+
+# Parsed JSON can be big too, so only keep a few around
+_PARSED_JSON_CACHE_SIZE = 8
+_parsed_json_cache: 'OrderedDict[bytes, JSONData]' = OrderedDict()
+
+
+def _unescape(match: re.Match[bytes]):
+	if match.lastindex == 3:
+		return match[3]
 	char_code = int(match[1] or match[2], 16)
 	if 0xD800 <= char_code <= 0xDFFF:
 		# Surrogates, which are going to cause problems if we let that happen, and also are not valid UTF-8 so we should probably just leave that as a hex escape and let pydantic_core parse it
-		return f'\\{match[0]}'
-	return chr(char_code)
-
-
-def _unescape_and_parse_json(text: 'JSONSource', path_for_log: Any = 'This string'):
-	"""The contents of a literal string passed to JSON.parse is not always exactly usable as JSON directly, because of escaping"""
-	text = re.sub(r'\\x([\dA-Fa-f]{2})|\\u([\dA-Fa-f]{4})', _convert_hex_escape, text)
-	text = re.sub(r'\\(.)', r'\1', text)
-	try:
-		return pydantic_core.from_json(text)
-	except TypeError:
-		# This shouldn't happen anymore, but just in case
-		logger.exception("wat? %s isn't stringy enough for pydantic_core", path_for_log)
-		return json.loads(text)
+		return match[0]
+	return chr(char_code).encode('utf-8')
+
+
+def _unescape_and_parse_json(text: 'JSONSource'):
+	"""The contents of a literal string passed to JSON.parse is not always exactly usable as JSON directly, because of escaping
+
+	The same JSON can show up in more than one chunk, so this is cached, which means the same object might be returned more than once, so don't modify it."""
+	buf = text.encode('utf-8', 'surrogatepass')
+	# The text can be several MB, so key the cache on a digest instead of keeping the text around
+	key = hashlib.blake2b(buf, digest_size=16).digest()
+	data = _parsed_json_cache.get(key)
+	if data is not None:
+		_parsed_json_cache.move_to_end(key)
+		return data
+
+	if b'\\' in buf:
+		if b'\\x' in buf or b'\\u' in buf:
+			buf = _unescape_regex.sub(_unescape, buf)
+		else:
+			buf = _simple_unescape_regex.sub(_escaped_char, buf)
+	data = pydantic_core.from_json(buf)
+	_parsed_json_cache[key] = data
+	if len(_parsed_json_cache) > _PARSED_JSON_CACHE_SIZE:
+		_parsed_json_cache.popitem(last=False)
+	return data
 
 
 def parse_json_literal(
@@ -72,7 +103,7 @@ def parse_json_literal(
 		# We can only parse strings, so raise an error with everything which is an argument to JSON.parse
 		blah = ''
 		blahblah = json_parse_start.next
-		while blahblah != json_parse_start.closed:
+		while blahblah is not json_parse_start.closed:
 			if blahblah is None:
 				break
 			blah += blahblah.text
@@ -80,12 +111,12 @@ def parse_json_literal(
 		raise NotParseableError(
 			f'Cannot parse JSON in {path_for_log}, because it has variables: {blah}'
 		)
-	if json_parse_arg.next != json_parse_start.closed:
+	if json_parse_arg.next is not json_parse_start.closed:
 		raise NotParseableError(
 			f'Cannot parse JSON in {path_for_log}, because it has more than one argument: {describe_token(json_parse_arg)}'
 		)
 	json_raw = json_parse_arg.text.strip('"\'')
-	j = _unescape_and_parse_json(json_raw, path_for_log)
+	j = _unescape_and_parse_json(json_raw)
 
 	# TODO: This only parses certain jsons, see also _next/static/chunks/57df6379-48b36665020add46.js for example, which has it start with "let l = " instead (but that in particular is probabably not something we need to worry about)
 
@@ -106,7 +137,7 @@ def parse_json_literal(
 	return int(float(key.text)), j
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class APIFunction:
 	"""A detected reference to an API endpoint in the JavaScript code."""
 
@@ -122,7 +153,10 @@ class APIFunction:
 	""""get", "post", etc"""
 
 
-def parse_api_url(text_token: 'Token', all_tokens: Iterable['Token']) -> 'APIFunction | URL':
+def parse_api_url(
+	text_token: 'Token', children_of: Mapping['Token | None', Sequence['Token']]
+) -> 'APIFunction | URL':
+	"""children_of: Result of group_by_parent for all the tokens in the file"""
 	method_args_start: Token = (
 		text_token.parent
 	)  # d.Mb.get, or perhaps d.Mb.post, etc #type: ignore[assignment]
@@ -131,10 +165,11 @@ def parse_api_url(text_token: 'Token', all_tokens: Iterable['Token']) -> 'APIFun
 	if try_block_start.previous.text == 'try':  # type: ignore[attr]
 		function_def_start: Token = try_block_start.parent  # type: ignore[assignment]
 		body_token = function_def_start
-		body = ''
-		while body_token != function_def_start.closed:
-			body += ('\n' * body_token.newlines) + body_token.whitespace_before + body_token.text  # type: ignore[attr]
+		body_parts: list[str] = []
+		while body_token is not function_def_start.closed:
+			body_parts += ('\n' * body_token.newlines, body_token.whitespace_before, body_token.text)  # type: ignore[attr]
 			body_token = body_token.next  # type: ignore[attr]
+		body = ''.join(body_parts)
 
 		function_args_end: Token = function_def_start.previous  # type: ignore[assignment]
 		function_args_begin = function_args_end.opened
@@ -143,11 +178,7 @@ def parse_api_url(text_token: 'Token', all_tokens: Iterable['Token']) -> 'APIFun
 		# blah.Mb = geoguessr.com
 		return APIFunction(
 			function_name.text,
-			[
-				t.text
-				for t in all_tokens
-				if t.parent == function_args_begin and t.type != 'TK_COMMA'
-			],
+			[t.text for t in children_of.get(function_args_begin, ()) if t.type != 'TK_COMMA'],
 			body,
 			text_token.text.strip('"\''),
 			method_args_start.previous.text,  # type: ignore[attr]
@@ -156,10 +187,19 @@ def parse_api_url(text_token: 'Token', all_tokens: Iterable['Token']) -> 'APIFun
 	# print(describe_token(try_block_start.parent.parent))
 
 
-def get_function_id(token: 'Token'):
-	"""Attempts to get the function ID in a webpack chunk that token is part of"""
+def get_function_id(token: 'Token', cache: 'dict[Token, FunctionID | None] | None' = None):
+	"""Attempts to get the function ID in a webpack chunk that token is part of
+
+	If cache is passed, it remembers the result for every parent that gets walked through, so other tokens inside the same function can stop as soon as they hit one of those"""
+	walked: list['Token'] = []
+	function_id = None
 	t = token.parent
 	while t is not None:
+		if cache is not None:
+			if t in cache:
+				function_id = cache[t]
+				break
+			walked.append(t)
 		# We are looking for a line among the lines of 12345: function(a, b, c) {
 		if (
 			t.type == 'TK_START_BLOCK'
@@ -177,27 +217,33 @@ def get_function_id(token: 'Token'):
 				function_id_token = opener.previous.previous.previous
 				if function_id_token and function_id_token.type == 'TK_WORD':
 					with contextlib.suppress(ValueError):
-						return int(function_id_token.text)
+						function_id = int(function_id_token.text)
+						break
 
 		t = t.parent
-	return None
+	if cache is not None:
+		for parent in walked:
+			cache[parent] = function_id
+	return function_id
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ArrayLiteral:
 	function_id: 'FunctionID | None'
 	variable_name: str
 	value: list[str]
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ObjectLiteral:
 	function_id: 'FunctionID | None'
 	variable_name: str
 	value: dict[str, str]
 
 
-def maybe_parse_literal(eq_token: 'Token'):
+def maybe_parse_literal(
+	eq_token: 'Token', function_id_cache: 'dict[Token, FunctionID | None] | None' = None
+):
 	name_token = eq_token.previous
 	if name_token is None or name_token.type != 'TK_WORD':
 		return None
@@ -206,18 +252,18 @@ def maybe_parse_literal(eq_token: 'Token'):
 		# nah
 		return None
 	start_token = eq_token.next
-	if start_token is None or start_token.next == start_token.closed:
+	if start_token is None or start_token.next is start_token.closed:
 		return None
 	if start_token.type == 'TK_START_EXPR' and start_token.text == '[':
 		t = start_token.next
 		list_items = []
-		while t and t != start_token.closed:
+		while t and t is not start_token.closed:
 			# could parse int/bool literals too I guess but those would be less likely to be useful or interesting
 			if t.type == 'TK_STRING':
 				text = t.text.strip('"\'')
 				list_items.append(text)
 
-				if t.next == start_token.closed:
+				if t.next is start_token.closed:
 					break
 				if t.next and t.next.type == 'TK_COMMA':
 					t = t.next
@@ -225,11 +271,11 @@ def maybe_parse_literal(eq_token: 'Token'):
 				return None
 
 			t = t.next
-		return ArrayLiteral(get_function_id(eq_token), name, list_items)
+		return ArrayLiteral(get_function_id(eq_token, function_id_cache), name, list_items)
 	if start_token.type == 'TK_START_BLOCK' and start_token.text == '{':
 		t = start_token.next
 		items = {}
-		while t and t != start_token.closed:
+		while t and t is not start_token.closed:
 			if (
 				t.type in {'TK_WORD', 'TK_RESERVED'}
 				and t.next
@@ -244,7 +290,7 @@ def maybe_parse_literal(eq_token: 'Token'):
 				if t.type == 'TK_STRING':
 					value = t.text.strip('"\'')
 					items[key] = value
-					if t.next == start_token.closed:
+					if t.next is start_token.closed:
 						# hmm maybe my loop is wrong
 						break
 					if t.next and t.next.type == 'TK_COMMA':
@@ -255,11 +301,11 @@ def maybe_parse_literal(eq_token: 'Token'):
 				return None
 
 			t = t.next
-		return ObjectLiteral(get_function_id(eq_token), name, items)
+		return ObjectLiteral(get_function_id(eq_token, function_id_cache), name, items)
 	return None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class InterestingThings:
 	api_functions: Collection[APIFunction]
 	"""All JavaScript functions that call an API endpoint that we were able to detect."""
@@ -277,6 +323,15 @@ class InterestingThings:
 	"""Detected object literals by function ID/name"""
 
 
+_QUOTES = frozenset('"\'')
+# Which group matches says what sort of URL it is, and they're tried in this order, so _next/static is a static URL and not just any old _next URL
+_url_prefix_regex = re.compile(
+	r'(?P<static>/_next/static/|_next/static)|(?P<other>/_next|_next|https://|http://|ftp://)|(?P<api>/api/)'
+)
+# Anything _url_prefix_regex matches starts with one of these, and most strings don't, so checking this first is quicker
+_URL_FIRST_CHARS = frozenset('/_hf')
+
+
 def _find_interesting_things_in_js(js: 'JSSource', path_for_log: Any | None = None):
 	tokens = tokenize_js(js, {'unescape_strings': False})
 	# unescape_strings is going to screw with the JSON parsing, because we need to make sure it doesn't end up having surrogates in it, otherwise I stay up until 2am wondering why errors are happening
@@ -290,28 +345,43 @@ def _find_interesting_things_in_js(js: 'JSSource', path_for_log: Any | None = No
 	arrays: list[ArrayLiteral] = []
 	objects: list[ObjectLiteral] = []
 
-	already_parsed = set()
-	for token in tokens:
-		if token in already_parsed:
+	# Indexed the same as tokens, nonzero if that token has already been dealt with (a set of tokens would end up hashing every single token)
+	already_parsed = bytearray(len(tokens))
+	# Only needed for API functions, which not every file has, so this gets built when it's first needed
+	children_of: Mapping[Token | None, Sequence[Token]] | None = None
+	# Lots of literals are inside the same webpack function, so this saves walking all the way up to it each time
+	function_id_cache: dict[Token, FunctionID | None] = {}
+	for i, token in enumerate(tokens):
+		if already_parsed[i]:
 			continue
-		if token.type == 'TK_STRING':
-			text: str = token.text.strip('"\'')
-			if text.startswith(('/_next/static/', '_next/static')):
-				static_urls.add(URLPath(text.removeprefix('/')))
-				already_parsed.add(token)
-			elif text.startswith(('/_next', '_next', 'https://', 'http://', 'ftp://')):
-				other_urls.add(text.removeprefix('/'))
-				already_parsed.add(token)
-			if text.startswith('/api/'):
-				api = parse_api_url(token, tokens)
+		token_type = token.type
+		if token_type == 'TK_STRING':
+			text: str = token.text
+			if text[:1] in _QUOTES:
+				text = text[1:-1]
+			if text[:1] not in _URL_FIRST_CHARS:
+				continue
+			prefix_match = _url_prefix_regex.match(text)
+			if not prefix_match:
+				continue
+			url_kind = prefix_match.lastgroup
+			if url_kind == 'static':
+				static_urls.add(URLPath(text[1:] if text[0] == '/' else text))
+				already_parsed[i] = 1
+			elif url_kind == 'other':
+				other_urls.add(text[1:] if text[0] == '/' else text)
+				already_parsed[i] = 1
+			else:
+				if children_of is None:
+					children_of = group_by_parent(tokens)
+				api = parse_api_url(token, children_of)
 				if isinstance(api, APIFunction):
 					api_functions.append(api)
 				else:
 					api_urls.add(text)
-				already_parsed.add(token)
+				already_parsed[i] = 1
 			# TODO: Should we detect other hardcoded strings?
-		if token.type == 'TK_WORD' and token.text == 'JSON':
-			# TODO: Add the argument to JSON.parse and such to already_parsed
+		elif token_type == 'TK_WORD' and token.text == 'JSON':
 			dot: Token = token.next  # type: ignore[assignment]
 			func_name: Token = dot.next  # type: ignore[assignment]
 			if func_name.text == 'parse':
@@ -322,11 +392,11 @@ def _find_interesting_things_in_js(js: 'JSSource', path_for_log: Any | None = No
 				except NotParseableError as e:
 					logger.debug('%s was not parseable: %s', path_for_log, e)
 				else:
-					already_parsed.add(token)
-					already_parsed.add(func_name)
+					# tokens goes JSON . parse ( "the string", and we don't want to look at the string again as if it was a URL or whatever
+					already_parsed[i] = already_parsed[i + 2] = already_parsed[i + 4] = 1
 					jsons[j[0]] = j[1]
-		if token.type == 'TK_EQUALS':
-			maybe_literal = maybe_parse_literal(token)
+		elif token_type == 'TK_EQUALS':
+			maybe_literal = maybe_parse_literal(token, function_id_cache)
 			if isinstance(maybe_literal, ArrayLiteral):
 				arrays.append(maybe_literal)
 			if isinstance(maybe_literal, ObjectLiteral):
@@ -338,8 +408,11 @@ def _find_interesting_things_in_js(js: 'JSSource', path_for_log: Any | None = No
 
 
 async def find_interesting_things(
-	js_path: Path, path_for_log: Any | None = None
+	js_path: Path, path_for_log: Any | None = None, executor: Executor | None = None
 ) -> InterestingThings:
-	"""path_for_log: If provided, this gets printed in the log instead of the whole entire js_path"""
+	"""path_for_log: If provided, this gets printed in the log instead of the whole entire js_path
+	executor: Where to do the actual parsing, as it is CPU bound; ideally a ProcessPoolExecutor (in which case path_for_log needs to be picklable), or None to use the event loop's default executor"""
 	js = await read_text(js_path)
-	return _find_interesting_things_in_js(js, path_for_log or js_path)
+	return await asyncio.get_running_loop().run_in_executor(
+		executor, _find_interesting_things_in_js, js, path_for_log or js_path
+	)
@@ -1,20 +1,400 @@
 """Putting everything else related to jsbeautifier here"""
 
-from collections.abc import Mapping, Sequence
-from typing import TYPE_CHECKING, Any
+import contextlib
+import hashlib
+import logging
+import os
+import pickle
+import re
+import tempfile
+from collections import defaultdict
+from collections.abc import Iterable, Mapping, Sequence
+from pathlib import Path
+from typing import Any
 
 import jsbeautifier
-from jsbeautifier.javascript.tokenizer import Tokenizer
+from jsbeautifier.core.token import Token
+from jsbeautifier.core.tokenstream import TokenStream
+from jsbeautifier.javascript.tokenizer import (
+	TOKEN,
+	Tokenizer,
+	directives_core,
+	number_pattern,
+	punct_pattern,
+	reserved_words,
+)
 
-if TYPE_CHECKING:
-	from jsbeautifier.core.token import Token
+logger = logging.getLogger(__name__)
 
+# Bump this if the format of what _flatten_tokens returns changes
+_DISK_CACHE_VERSION = 1
+_DISK_CACHE_ENV_VAR = 'GEOGUESSR_SOURCE_EXTRACTOR_TOKEN_CACHE'
 
-def tokenize_js(js: str, options: Mapping[str, Any] | None=None) -> 'Sequence[Token]':
-	beautifier_options = jsbeautifier.BeautifierOptions(options)
-	tokenizer = Tokenizer(js, beautifier_options)
-	token_stream = tokenizer.tokenize()
-	return tuple(token_stream)
+
+def _get_disk_cache_dir() -> Path | None:
+	"""Where tokenize_js keeps tokens between runs, or None if the user hasn't set GEOGUESSR_SOURCE_EXTRACTOR_TOKEN_CACHE to turn that on
+
+	It's off by default, because the pickles are about 9x the size of the source and nothing ever cleans them up, and reading them back is only a bit quicker than _tokenize_js_quickly anyway (it's more worth it for whatever has to go through jsbeautifier)"""
+	if not os.environ.get(_DISK_CACHE_ENV_VAR):
+		return None
+	cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+	return Path(cache_home, 'geoguessr-source-extractor', 'tokens')
+
+
+def _flatten_tokens(tokens: Sequence[Token]):
+	"""Tokens all point to each other, which pickle can cope with, but it's very slow and deeply recursive about it, so turn them into flat lists with indexes instead (-1 meaning None, or the start token for previous)"""
+	index = {id(t): i for i, t in enumerate(tokens)}
+
+	def index_of(t: Token | None):
+		return -1 if t is None else index.get(id(t), -1)
+
+	return (
+		_DISK_CACHE_VERSION,
+		[t.type for t in tokens],
+		[t.text for t in tokens],
+		[t.newlines for t in tokens],
+		[t.whitespace_before for t in tokens],
+		[t.directives for t in tokens],
+		[index_of(t.parent) for t in tokens],
+		[index_of(t.opened) for t in tokens],
+		[index_of(t.closed) for t in tokens],
+		{
+			i: [(c.type, c.text, c.newlines, c.whitespace_before, c.directives) for c in t.comments_before]
+			for i, t in enumerate(tokens)
+			if t.comments_before
+		},
+	)
+
+
+def _unflatten_tokens(flattened: tuple[Any, ...]) -> Sequence[Token]:
+	"""Turns the result of _flatten_tokens back into actual tokens"""
+	(
+		_,
+		types,
+		texts,
+		newlines,
+		whitespace_befores,
+		directives,
+		parents,
+		openeds,
+		closeds,
+		comments,
+	) = flattened
+	tokens = tuple(map(Token, types, texts, newlines, whitespace_befores))
+	previous = Token(TOKEN.START, '')
+	for i, token in enumerate(tokens):
+		token.directives = directives[i]
+		if parents[i] != -1:
+			token.parent = tokens[parents[i]]
+		if openeds[i] != -1:
+			token.opened = tokens[openeds[i]]
+		if closeds[i] != -1:
+			token.closed = tokens[closeds[i]]
+		token.previous = previous
+		previous.next = token
+		previous = token
+	for i, comment_list in comments.items():
+		stream = TokenStream()
+		for type_, text, comment_newlines, whitespace_before, comment_directives in comment_list:
+			comment = Token(type_, text, comment_newlines, whitespace_before)
+			comment.directives = comment_directives
+			stream.add(comment)
+		tokens[i].comments_before = stream
+	return tokens
+
+
+def _read_disk_cache(path: Path) -> Sequence[Token] | None:
+	try:
+		with path.open('rb') as f:
+			flattened = pickle.load(f)
+	except FileNotFoundError:
+		return None
+	except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, IndexError):
+		# Might be half written, or from some other version, or whatever, it'll just get overwritten
+		logger.debug('Could not read cached tokens from %s', path, exc_info=True)
+		return None
+	if flattened[0] != _DISK_CACHE_VERSION:
+		return None
+	return _unflatten_tokens(flattened)
+
+
+def _write_disk_cache(path: Path, tokens: Sequence[Token]):
+	try:
+		path.parent.mkdir(parents=True, exist_ok=True)
+		# Write to a temporary file and then move it into place, so other processes tokenizing the same thing at the same time never see it half written
+		fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				pickle.dump(_flatten_tokens(tokens), f, pickle.HIGHEST_PROTOCOL)
+			os.replace(temp_path, path)
+		except BaseException:
+			with contextlib.suppress(OSError):
+				os.unlink(temp_path)
+			raise
+	except OSError:
+		logger.debug('Could not cache tokens to %s', path, exc_info=True)
+
+
+class _CannotTokenizeQuicklyError(Exception):
+	"""The JavaScript has something in it that _tokenize_js_quickly can't be sure it deals with exactly the same way as jsbeautifier"""
+
+
+# jsbeautifier's whitespace, minus \r and the Unicode line separators, which _tokenize_js_quickly doesn't bother with
+_quick_whitespace = '\t \n\u00a0\u1680\u180e\u2000-\u200a\u202f\u205f\u3000\ufeff'
+# Everything here is tried in the same order as jsbeautifier's Tokenizer._get_next_token, and uses jsbeautifier's own patterns where it can, so it comes up with the same tokens
+# Anything not matched here (non-ASCII identifiers, backslashes outside of strings, etc) is left to jsbeautifier instead
+_quick_token_regex = re.compile(
+	f'[{_quick_whitespace}]*(?:'
+	r'(?P<string>"(?:[^"\\\n]|\\(?:[\s\S]|\Z))*"?|\'(?:[^\'\\\n]|\\(?:[\s\S]|\Z))*\'?)'
+	r'|(?P<template>`)'
+	# A # on its own is the start of an identifier too, except for these things which jsbeautifier treats specially
+	r'|(?P<word>(?!#(?:include|\d|\{))[#$@A-Za-z_][$0-9A-Za-z_]*)'
+	f'|(?P<number>{number_pattern.pattern})'
+	r'|(?P<start_expr>[(\[])|(?P<end_expr>[)\]])|(?P<start_block>\{)|(?P<end_block>\})'
+	r'|(?P<semicolon>;)|(?P<dot>\.(?=[^\d.]))|(?P<comma>,)'
+	r'|(?P<slash>/)'
+	f'|(?P<punct>{punct_pattern.pattern})'
+	r'|(?P<eof>\Z)'
+	')'
+)
+_quick_template_text_regex = re.compile(r'[^`\\$]*')
+_quick_template_expression_regex = re.compile(r'[^`}\\]*')
+_quick_regex_literal_regex = re.compile(
+	r'/(?:\\[^\n]?|\[(?:\\[^\n]?|[^\]\\\n])*\]?|[^/\\\[\n])*(?:/(?:[#$@A-Za-z_][$0-9A-Za-z_]*)?)?'
+)
+_quick_token_types = {
+	'string': TOKEN.STRING,
+	'number': TOKEN.WORD,
+	'start_expr': TOKEN.START_EXPR,
+	'end_expr': TOKEN.END_EXPR,
+	'start_block': TOKEN.START_BLOCK,
+	'end_block': TOKEN.END_BLOCK,
+	'semicolon': TOKEN.SEMICOLON,
+	'dot': TOKEN.DOT,
+	'comma': TOKEN.COMMA,
+	'eof': TOKEN.EOF,
+}
+_closers = {')': '(', ']': '[', '}': '{'}
+# Token types after which a / starts a regex literal instead of being division, same as Tokenizer.allowRegExOrXML
+_regex_after_types = frozenset(
+	(
+		TOKEN.COMMENT,
+		TOKEN.START_EXPR,
+		TOKEN.START_BLOCK,
+		TOKEN.START,
+		TOKEN.END_BLOCK,
+		TOKEN.OPERATOR,
+		TOKEN.EQUALS,
+		TOKEN.EOF,
+		TOKEN.SEMICOLON,
+		TOKEN.COMMA,
+	)
+)
+_regex_after_reserved = frozenset(('return', 'case', 'throw', 'else', 'do', 'typeof', 'yield'))
+
+
+def _allows_regex(previous: Token) -> bool:
+	if previous.type in _regex_after_types:
+		return True
+	if previous.type == TOKEN.RESERVED:
+		return previous.text in _regex_after_reserved
+	if previous.type == TOKEN.END_EXPR and previous.text == ')' and previous.opened:
+		before_paren = previous.opened.previous
+		return before_paren.type == TOKEN.RESERVED and before_paren.text in {'if', 'while', 'for'}
+	return False
+
+
+def _skip_template(js: str, pos: int, in_expression: bool = False) -> int:
+	"""Finds where the inside of a template literal (or an expression inside one, if in_expression) starting at pos ends, the same way as Tokenizer.parse_string does, which means template literals inside of expressions inside of template literals are fine but braces inside expressions are not"""
+	length = len(js)
+	if in_expression:
+		delimiter, run = '}', _quick_template_expression_regex
+	else:
+		delimiter, run = '`', _quick_template_text_regex
+	pos = run.match(js, pos).end()  # type: ignore[union-attr]
+	while pos < length:
+		c = js[pos]
+		if c == delimiter:
+			break
+		pos += 1
+		if c == '\\':
+			if pos < length:
+				pos += 1
+		elif in_expression and c == '`':
+			pos = _skip_template(js, pos)
+			if pos < length:
+				pos += 1
+		elif not in_expression and c == '$' and js.startswith('{', pos):
+			pos = _skip_template(js, pos + 1, in_expression=True)
+			if pos < length:
+				pos += 1
+		pos = run.match(js, pos).end()  # type: ignore[union-attr]
+	return pos
+
+
+def _tokenize_js_quickly(js: str) -> Sequence[Token]:
+	"""Does the same thing as jsbeautifier's Tokenizer (with the default options), but with one big regex instead of going through things character by character, which is a lot faster on big minified chunks.
+
+	Raises:
+		_CannotTokenizeQuicklyError: If there's something in js that this doesn't handle, in which case just use jsbeautifier"""
+	if '\r' in js or '\u2028' in js or '\u2029' in js:
+		raise _CannotTokenizeQuicklyError('line breaks other than \\n')
+
+	tokens: list[Token] = []
+	comments: list[Token] = []
+	previous = Token(TOKEN.START, '')
+	open_token: Token | None = None
+	open_stack: list[Token | None] = []
+	pos = 0
+	match_token = _quick_token_regex.match
+	while True:
+		m = match_token(js, pos)
+		if not m:
+			raise _CannotTokenizeQuicklyError(f'unknown thing at {pos}: {js[pos : pos + 20]!r}')
+		kind: str = m.lastgroup  # type: ignore[assignment]
+		start = m.start(kind)
+		end = m.end()
+		if start == pos:
+			newlines = 0
+			whitespace_before = ''
+		else:
+			whitespace = js[pos:start]
+			newlines = whitespace.count('\n')
+			whitespace_before = whitespace[whitespace.rfind('\n') + 1 :] if newlines else whitespace
+		text = js[start:end]
+		directives = None
+
+		if kind == 'template':
+			end = _skip_template(js, end)
+			if js.startswith('`', end):
+				end += 1
+			text = js[start:end]
+			token_type = TOKEN.STRING
+		elif kind == 'word':
+			if not tokens and js.startswith('#!', start):
+				raise _CannotTokenizeQuicklyError('shebang')
+			if (
+				text in reserved_words
+				and previous.type != TOKEN.DOT
+				and not (previous.type == TOKEN.RESERVED and previous.text in {'set', 'get'})
+			):
+				token_type = (
+					TOKEN.OPERATOR
+					if text in {'in', 'of'} and previous.type in {TOKEN.WORD, TOKEN.STRING}
+					else TOKEN.RESERVED
+				)
+			else:
+				token_type = TOKEN.WORD
+		elif kind == 'punct':
+			if not tokens and js.startswith('<!--', start):
+				raise _CannotTokenizeQuicklyError('HTML comment')
+			token_type = (
+				TOKEN.EQUALS if text == '=' else TOKEN.DOT if text == '?.' else TOKEN.OPERATOR
+			)
+		elif kind == 'slash':
+			next_char = js[start + 1 : start + 2]
+			if next_char == '*':
+				end = js.find('*/', start + 2)
+				end = len(js) if end == -1 else end + 2
+				text = js[start:end]
+				directives = directives_core.get_directives(text)
+				if directives and directives.get('ignore') == 'start':
+					raise _CannotTokenizeQuicklyError('beautify ignore directive')
+				token_type = TOKEN.BLOCK_COMMENT
+			elif next_char == '/':
+				end = js.find('\n', start)
+				if end == -1:
+					end = len(js)
+				text = js[start:end]
+				token_type = TOKEN.COMMENT
+			elif _allows_regex(previous):
+				end = _quick_regex_literal_regex.match(js, start).end()  # type: ignore[union-attr]
+				text = js[start:end]
+				token_type = TOKEN.STRING
+			else:
+				end = punct_pattern.match(js, start).end()  # type: ignore[union-attr]
+				text = js[start:end]
+				token_type = TOKEN.OPERATOR
+		else:
+			token_type = _quick_token_types[kind]
+
+		token = Token(token_type, text, newlines, whitespace_before)
+		pos = end
+		if token_type in {TOKEN.COMMENT, TOKEN.BLOCK_COMMENT}:
+			token.directives = directives
+			comments.append(token)
+			continue
+		if comments:
+			token.comments_before = TokenStream()
+			for comment in comments:
+				token.comments_before.add(comment)
+			comments = []
+
+		token.parent = open_token
+		token.previous = previous
+		previous.next = token
+		if token_type in {TOKEN.START_BLOCK, TOKEN.START_EXPR}:
+			open_stack.append(open_token)
+			open_token = token
+		elif (
+			token_type in {TOKEN.END_BLOCK, TOKEN.END_EXPR}
+			and open_token is not None
+			and open_token.text == _closers[text]
+		):
+			token.opened = open_token
+			open_token.closed = token
+			open_token = open_stack.pop()
+			token.parent = open_token
+
+		tokens.append(token)
+		previous = token
+		if token_type == TOKEN.EOF:
+			return tuple(tokens)
+
+
+def tokenize_js(js: str, options: Mapping[str, Any] | None = None) -> Sequence[Token]:
+	"""Tokenizes some JavaScript the way jsbeautifier does.
+
+	The result can be cached on disk (see _get_disk_cache_dir), so running this again on the same source doesn't need to tokenize everything all over again.
+
+	This returns everything at once rather than yielding tokens as it goes, because that wouldn't really save anything: a token's closed and next aren't filled in until later tokens have been read (and everything that uses this looks ahead with those), and the already_parsed bitmap in interesting_things need the whole thing anyway."""
+	cache_dir = _get_disk_cache_dir()
+	cache_path = None
+	if cache_dir:
+		hasher = hashlib.blake2b(js.encode('utf-8'), digest_size=16)
+		hasher.update(repr(sorted(options.items()) if options else ()).encode('utf-8'))
+		# The tokenizer might do things differently in a different version, so don't reuse tokens from that
+		cache_path = cache_dir / f'{hasher.hexdigest()}-{jsbeautifier.__version__}.pickle'
+	tokens = _read_disk_cache(cache_path) if cache_path else None
+	if tokens is None:
+		beautifier_options = jsbeautifier.BeautifierOptions(options)
+		# _tokenize_js_quickly only knows how to do what jsbeautifier does by default
+		if (
+			not beautifier_options.unescape_strings
+			and not beautifier_options.e4x
+			and beautifier_options.templating == ['auto']
+		):
+			try:
+				tokens = _tokenize_js_quickly(js)
+			except _CannotTokenizeQuicklyError as e:
+				logger.debug('Falling back to jsbeautifier to tokenize: %s', e)
+		if tokens is None:
+			tokenizer = Tokenizer(js, beautifier_options)
+			token_stream = tokenizer.tokenize()
+			tokens = tuple(token_stream)
+		if cache_path:
+			_write_disk_cache(cache_path, tokens)
+	return tokens
+
+
+def group_by_parent(tokens: 'Iterable[Token]') -> 'Mapping[Token | None, Sequence[Token]]':
+	"""Indexes tokens by their parent token in one pass, so looking up the children of a token doesn't need to scan through every single token each time.
+
+	Token doesn't define __eq__ or __hash__, so this is by identity (and tokens with no parent are under None)"""
+	children: defaultdict[Token | None, list[Token]] = defaultdict(list)
+	for t in tokens:
+		children[t.parent].append(t)
+	return children
 
 def describe_token(token: 'Token') -> dict[str, str | None | tuple[str | None, str | None] | Any]:
 	return {
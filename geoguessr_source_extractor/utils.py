@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import json
 import shutil
 from collections.abc import Collection, Mapping, Sequence
@@ -7,9 +8,9 @@ from io import BytesIO
 from pathlib import Path, PurePath
 from typing import TYPE_CHECKING, Any, TypeVar
 
-import aiofiles
 import aiofiles.os
 import aiofiles.ospath
+import orjson
 from tqdm.auto import tqdm
 
 from .typedefs import URLPath
@@ -27,22 +28,35 @@ VT = TypeVar('VT')
 def reverse_dict_of_lists(d: Mapping[KT, Collection[VT]]) -> Mapping[VT, Sequence[KT]]:
 	out: dict[VT, list[KT]] = {}
 	for k, v in d.items():
-		for vv in v:
-			_list = out.setdefault(vv, [])
-			if k not in _list:
-				_list.append(k)
+		# Each k only comes up once, so the only way it could end up in a list twice is if v has duplicates, and dict.fromkeys gets rid of those (keeping the order) without having to search through the lists
+		for vv in dict.fromkeys(v):
+			out.setdefault(vv, []).append(k)
+	return out
+
+
+def reverse_dict_of_path_lists(
+	d: Mapping[Path, Collection[VT]], root_dir: Path
+) -> Mapping[VT, Sequence[str]]:
+	"""Same as reverse_dict_of_lists({abbrev_path(k, root_dir): v for k, v in d.items()}), but in one go without building that intermediate dict.
+
+	This assumes each collection in d doesn't have duplicates in it (and it's a set or something in practice), so it doesn't check for those."""
+	out: dict[VT, list[str]] = {}
+	for path, values in d.items():
+		relative_path = abbrev_path(path, root_dir)
+		for value in values:
+			out.setdefault(value, []).append(relative_path)
 	return out
 
 
 async def read_text(path: Path, encoding: str = 'utf-8'):
 	#yeah I really just didn't feel like typing this out every time, whatevs
-	async with aiofiles.open(path, encoding=encoding) as f:
-		return await f.read()
+	# Same deal as write_text, reading it all in one go in a thread is quicker than aiofiles reading it bit by bit
+	return await asyncio.to_thread(path.read_text, encoding)
 
 
 async def write_text(path: Path, s: str, encoding: str = 'utf-8', errors: str='strict'):
-	async with aiofiles.open(path, 'w', encoding=encoding, errors=errors) as f:
-		await f.write(s)
+	# One trip to a thread for the whole open/write/close is quicker than aiofiles doing each separately, and we always write the whole thing at once anyway
+	await asyncio.to_thread(path.write_text, s, encoding, errors)
 
 
 def json_default(o: Any):
@@ -53,16 +67,74 @@ def json_default(o: Any):
 	return o
 
 
+def _indent_with_tabs(j: bytes) -> bytes:
+	"""Turns orjson's two space indentation into tabs
+
+	Strings can't have actual newlines in them, so spaces after a newline are only ever indentation. Doing a replace for each level of indentation (deepest first, so shallower ones don't match part of it) is quicker than a regex calling back into Python for every line."""
+	depth = 0
+	while b'\n' + b'  ' * (depth + 1) in j:
+		depth += 1
+	for level in range(depth, 0, -1):
+		j = j.replace(b'\n' + b'  ' * level, b'\n' + b'\t' * level)
+	return j
+
+
+def format_json(data: 'JSONData', *, sort_keys: bool = False) -> bytes:
+	"""Formats data as JSON (as UTF-8), indented with tabs"""
+	option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+	if sort_keys:
+		option |= orjson.OPT_SORT_KEYS
+	try:
+		j = orjson.dumps(data, default=json_default, option=option)
+	except orjson.JSONEncodeError:
+		# orjson can't do everything the standard library can (e.g. ints bigger than 64 bits), but it's a lot faster, so only use this if we have to
+		return json.dumps(
+			data, indent='\t', ensure_ascii=False, sort_keys=sort_keys, default=json_default
+		).encode('utf-8')
+	# orjson only indents with two spaces, which would make every file look different to what it used to, so turn that back into tabs
+	return _indent_with_tabs(j)
+
+
+_created_dirs: set[Path] = set()
+
+
+async def ensure_dir(path: Path):
+	"""Makes a directory (and its parents) if it doesn't exist already.
+
+	Lots of files get written to the same few directories, so this remembers which ones it has already done, instead of going off to a thread to call makedirs every time. deltree_if_exists knows to forget about anything it deletes."""
+	if path in _created_dirs:
+		return
+	await aiofiles.os.makedirs(path, exist_ok=True)
+	_created_dirs.add(path)
+
+
 async def write_json(path: Path, data: 'JSONData', *, sort_keys: bool = False):
-	await aiofiles.os.makedirs(path.parent, exist_ok=True)
-	j = json.dumps(data, indent='\t', ensure_ascii=False, sort_keys=sort_keys, default=json_default)
-	await write_text(path, j)
+	await ensure_dir(path.parent)
+	await asyncio.to_thread(path.write_bytes, format_json(data, sort_keys=sort_keys))
 
 
-async def _read_response_with_progress(response: 'aiohttp.ClientResponse', **tqdm_kwargs):
-	bytesio = BytesIO()
+_PROGRESS_BAR_MIN_SIZE = 1024 * 1024
+
+
+def _get_content_length(response: 'aiohttp.ClientResponse') -> int | None:
 	content_length_str = response.headers.get('Content-Length')
-	content_length = int(content_length_str) if content_length_str else float('inf')
+	return int(content_length_str) if content_length_str else None
+
+
+async def _read_response(response: 'aiohttp.ClientResponse', **tqdm_kwargs) -> bytes:
+	"""Reads the whole response, with a progress bar if it's big enough for that to be worth it"""
+	content_length = _get_content_length(response)
+	# Most things are small JS chunks or images, where setting up tqdm and writing bit by bit would take longer than just reading the thing, and if we don't know the length the progress bar isn't very useful anyway
+	if content_length is None or content_length < _PROGRESS_BAR_MIN_SIZE:
+		return await response.read()
+	return await _read_response_with_progress(response, content_length, **tqdm_kwargs)
+
+
+async def _read_response_with_progress(
+	response: 'aiohttp.ClientResponse', content_length: int, **tqdm_kwargs
+):
+	# getvalue doesn't copy the buffer as long as nothing else is looking at it, so this is fine
+	bytesio = BytesIO()
 	with tqdm.wrapattr(
 		bytesio,
 		'write',
@@ -70,7 +142,6 @@ async def _read_response_with_progress(response: 'aiohttp.ClientResponse', **tqd
 		unit_scale=True,
 		unit_divisor=1024,
 		total=content_length,
-		disable=content_length < 1024,
 		**tqdm_kwargs,
 	) as b:
 		async for chunk, _ in response.content.iter_chunks():
@@ -89,7 +160,7 @@ async def get_binary_file(
 		response.raise_for_status()
 		if not progress:
 			return await response.content.read()
-		return await _read_response_with_progress(response, desc=url, leave=False)
+		return await _read_response(response, desc=url, leave=False)
 
 
 async def download_binary_file(
@@ -100,10 +171,9 @@ async def download_binary_file(
 	*,
 	progress: bool = True,
 ):
-	await aiofiles.os.makedirs(out_path.parent, exist_ok=True)
+	await ensure_dir(out_path.parent)
 	data = await get_binary_file(session, static_url, semaphore, progress=progress)
-	async with aiofiles.open(out_path, 'wb') as f:
-		await f.write(data)
+	await asyncio.to_thread(out_path.write_bytes, data)
 
 
 async def get_text(
@@ -115,7 +185,7 @@ async def get_text(
 		response.raise_for_status()
 		if not progress:
 			return await response.text()
-		content = await _read_response_with_progress(response, desc=url, leave=False)
+		content = await _read_response(response, desc=url, leave=False)
 		return content.decode('utf-8')
 
 
@@ -123,7 +193,10 @@ async def deltree_if_exists(path: Path):
 	if not await aiofiles.ospath.isdir(path):
 		return
 	await asyncio.to_thread(shutil.rmtree, path)
+	_created_dirs.difference_update([d for d in _created_dirs if d.is_relative_to(path)])
 
 
+@functools.lru_cache(maxsize=None)
 def abbrev_path(path: Path, root_dir: Path):
+	"""Cached, because the dumping stuff calls this with the same few files over and over again"""
 	return str(path.relative_to(root_dir) if path.is_relative_to(root_dir) else path)
@@ -1,98 +1,243 @@
+import re
 from collections.abc import Sequence
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, NamedTuple
 
-from .tokenize import tokenize_js
 from .typedefs import URLPath
 
 if TYPE_CHECKING:
-	from jsbeautifier.core.token import Token
-
 	from .typedefs import JSSource, ModuleID
 
+# We only need a few kinds of tokens out of the webpack runtime, so this is a lot less fussy than what jsbeautifier does, and numbers count as words like they do there
+# In minified code a regex literal comes straight after the punctuation or keyword before it, so there's no whitespace to worry about for that
+# This works on bytes, because comparing ints is quicker than comparing strs, and the runtime is all ASCII outside of strings anyway
+_webpack_token_regex = re.compile(
+	rb'(?P<comment>//[^\n]*|/\*[\s\S]*?\*/)'
+	rb'|(?P<string>"(?:[^"\\\n]|\\[\s\S])*"|\'(?:[^\'\\\n]|\\[\s\S])*\'|`(?:[^`\\]|\\[\s\S])*`)'
+	rb'|(?P<regex>(?:(?<=[(,=:\[!&|?{};])|(?<=return))/(?![*/])(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[a-z]*)'
+	rb'|(?P<word>[$\w]+)'
+	rb'|(?P<punct>===|!==|==|!=|<=|>=|=>|&&|\|\||\?\?|\?\.|\.\.\.|[^\s$\w])'
+)
 
-def _is_h_u_function(token: 'Token'):
-	if token.type == 'TK_WORD' and token.text == 'h':
-		next_token = token.next
-		if next_token is None:
-			# type hinters say they could never do it
-			return False
-		if next_token.text == '.':
-			next_next_token = next_token.next
-			if next_next_token is None:
-				return False
-			return next_next_token.text == 'u'
-	return False
+# Each token gets a tag, which is its kind << 8, plus the byte value of the character if the text is only one character long (like most punctuation, or e), so checking for a specific token is just one int comparison
+_PUNCT = 0
+_WORD = 1
+_STRING = 2
+_REGEX = 3
+_STRICT_EQUALS = 4
+"""=== is the only punctuation longer than one character that we care about, so it gets its own kind"""
+_kinds = {'punct': _PUNCT, 'word': _WORD, 'string': _STRING, 'regex': _REGEX}
 
 
-def parse_webpack(webpack_js: 'JSSource') -> Sequence[URLPath]:
-	tokens = tokenize_js(webpack_js)
-	# hrm now this gets weird
-	# Right now, the function we want to look at is declared as h.u = function(e) {...}
-	func_h: Token = next(t for t in tokens if _is_h_u_function(t))
-	func_h_u: Token = func_h.next.next  # type: ignore[assignment,attr]
-	func_h_u_eq: Token = func_h_u.next  # type: ignore[assignment]
-	func_start: Token = func_h_u_eq.next  # type: ignore[assignment]
-	func_args_start: Token = func_start.next  # type: ignore[assignment]
-	func_args_end: Token | None = func_args_start.closed  # type: ignore[assignment]
-	assert func_args_end, 'uh oh'
-	func_body_start: Token = func_args_end.next  # type: ignore[assignment]
-	func_body_end: Token = func_body_start.closed  # type: ignore[assignment]
-	func_body = [t for t in tokens if t.parent == func_body_start]
-
-	d: dict[ModuleID, URLPath] = {}
-	# {Module ID: path to chunk)
-	token = func_body[0]
-	value_token: Token | None = None  # c, in a ? b : c
-	while token != func_body_end:
+def _tag(kind: int, text: bytes) -> int:
+	return kind << 8 | text[0] if len(text) == 1 else kind << 8
+
+
+_STRICT_EQUALS_TAG = _tag(_STRICT_EQUALS, b'===')
+_E = _tag(_WORD, b'e')
+_PLUS = _tag(_PUNCT, b'+')
+_COLON = _tag(_PUNCT, b':')
+_OPEN_PAREN = _tag(_PUNCT, b'(')
+_OPEN_BRACE = _tag(_PUNCT, b'{')
+_CLOSE_BRACE = _tag(_PUNCT, b'}')
+_closers = {
+	_OPEN_PAREN: _tag(_PUNCT, b')'),
+	_tag(_PUNCT, b'['): _tag(_PUNCT, b']'),
+	_OPEN_BRACE: _CLOSE_BRACE,
+}
+# The function we want to look at is declared as h.u = function(e) {...}, finding that first means we don't have to tokenize the whole runtime
+# Checking it's not part of some longer name with a lookbehind after h.u instead of \b before it means the regex starts with a literal, so re can skip ahead to each h.u quickly instead of trying to match at every single position
+_h_u_function_regex = re.compile(rb'h\.u(?<![$\w]h\.u)\s*=\s*function\s*\(')
+# Module ID: chunk hash, inside the big dict at the end of h.u
+_chunk_hash_regex = re.compile(rb'(\d+)\s*:\s*["\']([^"\']*)["\']')
+# What h.u normally looks like, so most of the time it can be picked apart with regexes without having to tokenize anything:
+# h.u=function(e){return 123===e?"static/chunks/"+e+"-abc.js":...:"static/chunks/"+e+"."+({456:"def",...})[e]+".js"}
+# Anything even slightly different from this goes through the tokens instead
+_h_u_template_regex = re.compile(
+	rb'h\.u=function\(e\)\{return\s*'
+	rb'((?:\d+===e\?"[^"\\]*"(?:\+e\+"[^"\\]*")*:)+)'
+	rb'"[^"\\]*"(?:\+e\+"[^"\\]*")*\+\(\{((?:\d+:"[^"\\]*",?)*)\}\)\[e\]\+"[^"\\]*"\}'
+)
+_h_u_template_case_regex = re.compile(rb'(\d+)===e\?("[^"\\]*"(?:\+e\+"[^"\\]*")*):')
+
+
+class _WebpackToken(NamedTuple):
+	tag: int
+	"""See _tag"""
+	text: bytes
+	start: int
+	"""Where this token starts in the source"""
+
+
+def _tokenize_webpack_function(
+	webpack_js: bytes, pos: int
+) -> tuple[list[_WebpackToken], list[int]]:
+	"""Tokenizes webpack_js starting at pos, and stops at the end of the first {} block, which will be the function body if pos is where a function is declared
+
+	Brackets get matched up as it goes, so that doesn't need another pass over the tokens afterwards.
+
+	Returns:
+		Tokens, and the same idea as Token.closed for each one: the index of the bracket that closes the one there, or -1 if it's not a bracket or never gets closed (this isn't part of _WebpackToken because it's only known once the closing bracket is reached)"""
+	tokens: list[_WebpackToken] = []
+	close_of: list[int] = []
+	open_indexes: list[int] = []
+	depth = 0
+	for m in _webpack_token_regex.finditer(webpack_js, pos):
+		group: str = m.lastgroup  # type: ignore[assignment]
+		if group == 'comment':
+			continue
+		text = m[0]
+		if len(text) == 1:
+			tag = _kinds[group] << 8 | text[0]
+		elif text == b'===':
+			tag = _STRICT_EQUALS_TAG
+		else:
+			tag = _kinds[group] << 8
+		if tag in _closers:
+			open_indexes.append(len(tokens))
+		elif open_indexes and tag == _closers[tokens[open_indexes[-1]].tag]:
+			close_of[open_indexes.pop()] = len(tokens)
+		tokens.append(_WebpackToken(tag, text, m.start()))
+		close_of.append(-1)
+		if tag == _OPEN_BRACE:
+			depth += 1
+		elif tag == _CLOSE_BRACE:
+			depth -= 1
+			if not depth:
+				break
+	return tokens, close_of
+
+
+def _add_chunk_hash_paths(
+	big_dict: bytes, paths: list[URLPath], seen_module_ids: set['ModuleID']
+):
+	for key, value in _chunk_hash_regex.findall(big_dict):
+		module_id = int(key)
+		if module_id not in seen_module_ids:
+			seen_module_ids.add(module_id)
+			paths.append(URLPath(f'_next/static/chunks/{key.decode()}.{value.decode()}.js'))
+
+
+def _parse_h_u_template(template_match: 're.Match[bytes]') -> tuple[URLPath, ...]:
+	"""Gets the same results as the rest of _parse_webpack, from a match of _h_u_template_regex"""
+	paths: list[URLPath] = []
+	seen_module_ids: set[ModuleID] = set()
+	for key, value in _h_u_template_case_regex.findall(template_match[1]):
+		module_id = int(key)
+		if module_id not in seen_module_ids:
+			seen_module_ids.add(module_id)
+			# "static/chunks/"+e+".js" -> static/chunks/123.js
+			value = value[1:-1].replace(b'"+e+"', key)
+			paths.append(URLPath('_next/' + value.decode('utf-8')))
+	_add_chunk_hash_paths(template_match[2], paths, seen_module_ids)
+	return tuple(paths)
+
+
+def _parse_ternary_cases(
+	tokens: Sequence[_WebpackToken],
+	start: int,
+	end: int,
+	paths: list[URLPath],
+	seen_module_ids: set['ModuleID'],
+) -> int | None:
+	"""Adds the path for each key === e ? value case in tokens[start:end] to paths.
+
+	Returns:
+		Index of the last token of the value of the last case, or None if there were no cases"""
+	i = start
+	value_index: int | None = None  # c, in a ? b : c
+	while i < end:
 		# hrm this will be annoying
 		# To be fair it is also annoying for a human to try reading it
 		# Lots of nested ternary cases
+		tag, key, _ = tokens[i]
 		if (
-			token.type == 'TK_WORD'  # type: ignore[attr]
-			and token.next.type == 'TK_OPERATOR'  # type: ignore[attr]
-			and token.next.text == '==='  # type: ignore[attr]
-			and token.next.next.type == 'TK_WORD'  # type: ignore[attr]
-			and token.next.next.text == 'e'  # type: ignore[attr]
+			tag >> 8 == _WORD
+			and tokens[i + 1].tag == _STRICT_EQUALS_TAG
+			and tokens[i + 2].tag == _E
 		):
-			key: str = token.text  # type: ignore[attr]
-			question_mark: Token = token.next.next.next  # type: ignore[attr]
-			value_token = question_mark.next
-			if value_token.type == 'TK_STRING':  # type: ignore[attr]
-				value: str = value_token.text.strip('"\'')  # type: ignore[attr]
-				while not (value_token.next.type == 'TK_OPERATOR' and value_token.next.text == ':'):  # type: ignore[attr]
-					value_token = value_token.next  # type: ignore[attr]
-					if value_token.type == 'TK_OPERATOR' and value_token.text == '+':  # type: ignore[attr]
+			# key === e ? value
+			value_index = i + 4
+			value_tag, value_text, _ = tokens[value_index]
+			if value_tag >> 8 == _STRING:
+				# Our string tokens always have both quotes, so they can just be chopped off
+				value_parts = [value_text[1:-1]]
+				while tokens[value_index + 1].tag != _COLON:
+					value_index += 1
+					value_tag, value_text, _ = tokens[value_index]
+					if value_tag == _PLUS:
 						continue
-					value += (
-						key
-						if value_token.type == 'TK_WORD' and value_token.text == 'e'  # type: ignore[attr]
-						else value_token.text.strip('"\'')  # type: ignore[attr]
-					)
-				d[int(key)] = URLPath('_next/') / value
-				token = value_token.next  # type: ignore[attr]
-		token = token.next  # type: ignore[attr]
-	assert value_token
-	last_ternary_case: Token = value_token.next.next  # type: ignore[attr]
-	token = last_ternary_case
+					if value_tag >> 8 == _STRING:
+						value_parts.append(value_text[1:-1])
+					else:
+						value_parts.append(key if value_tag == _E else value_text)
+				module_id = int(key)
+				if module_id not in seen_module_ids:
+					seen_module_ids.add(module_id)
+					paths.append(URLPath('_next/' + b''.join(value_parts).decode('utf-8')))
+				i = value_index + 1
+		i += 1
+	return value_index
+
+
+def _find_big_dict(
+	tokens: Sequence[_WebpackToken], close_of: Sequence[int], start: int, end: int
+) -> tuple[int, int] | None:
+	"""Finds the dict inside the first ( in tokens[start:end]
+
+	Returns:
+		Indexes of the opening and closing brace, or None if there was no ("""
+	for i in range(start, end):
+		if tokens[i].tag == _OPEN_PAREN:
+			big_dict_start = i + 1
+			big_dict_end = close_of[big_dict_start]
+			assert big_dict_end != -1, 'uh oh'
+			return big_dict_start, big_dict_end
+	return None
+
+
+def _parse_h_u_tokens(webpack_js: bytes, pos: int) -> tuple[URLPath, ...]:
+	"""Does the job of _parse_webpack the slow way, for when h.u (starting at pos) doesn't look exactly like _h_u_template_regex expects"""
+	tokens, close_of = _tokenize_webpack_function(webpack_js, pos)
+	# Tokenizing started at h.u, so the tokens are h . u = function ( and then the arguments
+	func_args_start = 5
+	func_args_end = close_of[func_args_start]
+	assert func_args_end != -1, 'uh oh'
+	func_body_start = func_args_end + 1
+	func_body_end = close_of[func_body_start]
+	assert func_body_end != -1, 'uh oh'
+
+	paths: list[URLPath] = []
+	# If a module ID shows up more than once, the ternary case comes first and that's what h.u would return, so the later ones don't count
+	seen_module_ids: set[ModuleID] = set()
+	last_value_index = _parse_ternary_cases(
+		tokens, func_body_start + 1, func_body_end, paths, seen_module_ids
+	)
+	assert last_value_index
+	# The last ternary case is after the :
 	# We already know it's "static/chunks/" + e + "." + ({big ass dict})[e]
-	while token != func_body_start.closed:
-		if token.type == 'TK_START_EXPR' and token.text == '(':  # type: ignore[attr]
-			big_dict_start = token.next  # type: ignore[attr]
-			# int keys, so we can't just parse it as JSON, going to have to do it manually
-			while token != big_dict_start.closed:  # type: ignore[attr]
-				token = token.next  # type: ignore[attr]
-				if token.next.type == 'TK_OPERATOR' and token.next.text == ':':  # type: ignore[attr]
-					key = token.text  # type: ignore[attr]
-					value_token = token.next.next  # type: ignore[attr]
-					value = value_token.text.strip('"\'')  # type: ignore[attr]
-					d[int(key)] = URLPath(f'_next/static/chunks/{key}.{value}.js')
-					token = value_token.next  # Comma #type: ignore[attr]
-			# big_dict = ''
-			# while token != big_dict_start.closed:
-			# 	token = token.next
-			# 	big_dict += token.text
-			# d.update({k: f'static/chunks/{k}.{v}.js' for k, v in json.loads(big_dict).items()})
-			break
-		token = token.next  # type: ignore[attr]
-
-	return tuple(d.values())
+	big_dict = _find_big_dict(tokens, close_of, last_value_index + 2, func_body_end)
+	if big_dict:
+		big_dict_start, big_dict_end = big_dict
+		# int keys, so we can't just parse it as JSON, but it's all simple enough for a regex to pick out
+		_add_chunk_hash_paths(
+			webpack_js[tokens[big_dict_start].start : tokens[big_dict_end].start],
+			paths,
+			seen_module_ids,
+		)
+
+	return tuple(paths)
+
+
+def _parse_webpack(webpack_js: bytes) -> tuple[URLPath, ...]:
+	# hrm now this gets weird
+	h_u_function = _h_u_function_regex.search(webpack_js)
+	assert h_u_function, 'h.u = function was not found'
+	template_match = _h_u_template_regex.match(webpack_js, h_u_function.start())
+	if template_match:
+		return _parse_h_u_template(template_match)
+	return _parse_h_u_tokens(webpack_js, h_u_function.start())
+
+
+def parse_webpack(webpack_js: 'JSSource') -> Sequence[URLPath]:
+	"""Finds all the chunk paths that webpack knows about, from the h.u function in the webpack runtime."""
+	return _parse_webpack(webpack_js.encode('utf-8'))